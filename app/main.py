@@ -2,12 +2,17 @@ import os
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates  # Import this
-from app.routes import admin, voting
+from app.routes import admin, voting, stats
+from app.services.stats_service import ensure_stats_indexes
+from app.services.profiling_service import ProfilingMiddleware
 from pathlib import Path
 import pymongo 
 
 app = FastAPI()
 
+# On-demand profiling (no-op unless an admin arms it via /api/admin/profiling/arm)
+app.add_middleware(ProfilingMiddleware)
+
 # --- DATABASE REPAIR LOGIC START ---
 def fix_broken_urls():
     """
@@ -72,6 +77,10 @@ def fix_broken_urls():
 @app.on_event("startup")
 async def startup_event():
     fix_broken_urls()
+    try:
+        ensure_stats_indexes()
+    except Exception as e:
+        print(f"❌ STATS INDEX SETUP FAILED: {e}")
 # --- DATABASE REPAIR LOGIC END ---
 
 
@@ -88,6 +97,7 @@ templates = Jinja2Templates(directory=str(FRONTEND_DIR))
 # Include API Routes
 app.include_router(admin.router, prefix="/api/admin")
 app.include_router(voting.router, prefix="/api/vote")
+app.include_router(stats.router, prefix="/api/stats")
 
 # Handle Favicon
 @app.get("/favicon.ico", include_in_schema=False)
@@ -13,11 +13,16 @@ class Contestant(BaseModel):
 
 class Match(BaseModel):
     match_id: int
-    contestant_a: Contestant
+    contestant_a: Optional[Contestant] = None  # None until the feeding match is decided
     contestant_b: Optional[Contestant] = None
     votes_a: int = 0
     votes_b: int = 0
     winner_id: Optional[str] = None
+    # Bracket tree: winner moves into contestant_{parent_side} of parent_slot
+    slot_id: Optional[str] = None
+    parent_slot: Optional[str] = None
+    parent_side: Optional[Literal['a', 'b']] = None
+    is_bye: bool = False
 
 class Round(BaseModel):
     round_index: int
@@ -25,6 +30,12 @@ class Round(BaseModel):
     matches: List[Match]
     end_time: datetime
 
+class BracketLayout(BaseModel):
+    # Slot ids per column, first round first
+    left: List[List[str]] = []
+    right: List[List[str]] = []
+    final: List[str] = []
+
 class Tournament(BaseModel):
     name: str
     voting_duration_minutes: int
@@ -33,6 +44,7 @@ class Tournament(BaseModel):
     status: Literal['draft', 'active', 'completed', 'cancelled'] = 'draft'
     contestants: List[Contestant] = []
     rounds: List[Round] = []
+    bracket_layout: Optional[BracketLayout] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class TournamentCreate(BaseModel):
@@ -49,4 +61,9 @@ class VoteLog(BaseModel):
     
 class LoginRequest(BaseModel):
     password: str
-    
\ No newline at end of file
+    
+class ProfilingArmRequest(BaseModel):
+    mode: Literal['sampling', 'deterministic'] = 'sampling'
+    requests: int = Field(1, ge=1, le=100)  # Profile the next N matching requests
+    route: Optional[str] = None             # Path prefix, e.g. /api/vote/tournament
+    tournament_id: Optional[str] = None
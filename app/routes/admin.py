@@ -2,14 +2,16 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Depends, Header, Body
+from fastapi.responses import PlainTextResponse
 from jose import jwt, JWTError
-from app.models import TournamentCreate, Tournament, Contestant, LoginRequest
-from app.services.bracket_service import create_initial_round
+from app.models import TournamentCreate, Tournament, Contestant, LoginRequest, ProfilingArmRequest
+from app.services.bracket_service import create_bracket
 from app.services.spotify_service import SpotifyService
+from app.services.profiling_service import profiler, ProfiledRoute
 from app.database import get_database
 from bson.objectid import ObjectId
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 db = get_database()
 spotify_service = SpotifyService()
 
@@ -48,6 +50,35 @@ async def login(payload: LoginRequest):
 
 # --- 2. PROTECTED ROUTES (Require verify_admin) ---
 
+# --- PROFILING (declared before the /{tournament_id} routes) ---
+@router.post("/profiling/arm")
+async def arm_profiling(payload: ProfilingArmRequest, _: None = Depends(verify_admin)):
+    if not payload.route and not payload.tournament_id:
+        raise HTTPException(status_code=400, detail="Provide a route or a tournament_id")
+
+    profiler.arm(payload.mode, payload.requests, payload.route, payload.tournament_id)
+    return {"message": f"Profiling armed for the next {payload.requests} matching requests"}
+
+@router.post("/profiling/disarm")
+async def disarm_profiling(_: None = Depends(verify_admin)):
+    profiler.disarm()
+    return {"message": "Profiling disarmed"}
+
+@router.get("/profiling")
+async def get_profiling_status(_: None = Depends(verify_admin)):
+    return profiler.status()
+
+@router.get("/profiling/captures/{capture_id}")
+async def download_capture(capture_id: int, _: None = Depends(verify_admin)):
+    capture = profiler.get_capture(capture_id)
+    if not capture:
+        raise HTTPException(status_code=404, detail="Capture not found (it may have been evicted)")
+
+    return PlainTextResponse(
+        capture.to_folded(),
+        headers={"Content-Disposition": f'attachment; filename="profile_{capture_id}.folded"'}
+    )
+
 @router.post("/create")
 async def create_tournament(
     payload: TournamentCreate, 
@@ -115,11 +146,15 @@ async def start_tournament(tournament_id: str, _: None = Depends(verify_admin)):
     if len(contestants) < 2:
         raise HTTPException(status_code=400, detail="Need 2+ songs")
 
-    rounds = create_initial_round(contestants, t["voting_duration_minutes"])
+    rounds, layout = create_bracket(contestants, t["voting_duration_minutes"])
 
     db.tournaments.update_one(
         {"_id": ObjectId(tournament_id)},
-        {"$set": {"status": "active", "rounds": [r.dict() for r in rounds]}}
+        {"$set": {
+            "status": "active",
+            "rounds": [r.dict() for r in rounds],
+            "bracket_layout": layout.dict()
+        }}
     )
     return {"message": "Started"}
 
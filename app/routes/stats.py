@@ -0,0 +1,41 @@
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query
+from app.services.profiling_service import ProfiledRoute
+from app.services.stats_service import get_song_leaderboard, get_artist_leaderboard, get_closest_matches
+
+router = APIRouter(route_class=ProfiledRoute)
+
+SortField = Literal["wins", "losses", "titles", "total_votes", "margin", "tournaments_entered"]
+
+
+def _run_page(fetch, *args):
+    try:
+        return fetch(*args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/songs")
+async def song_leaderboard(
+    sort: SortField = "wins",
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    return _run_page(get_song_leaderboard, sort, cursor, limit)
+
+
+@router.get("/artists")
+async def artist_leaderboard(
+    sort: SortField = "wins",
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    return _run_page(get_artist_leaderboard, sort, cursor, limit)
+
+
+@router.get("/closest-matches")
+async def closest_matches(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    return _run_page(get_closest_matches, cursor, limit)
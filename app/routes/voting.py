@@ -2,10 +2,11 @@ from fastapi import APIRouter, HTTPException, Request
 from app.database import get_database
 from app.models import VoteLog
 from app.services.bracket_service import process_round_progression
+from app.services.profiling_service import ProfiledRoute
 from bson.objectid import ObjectId
 import hashlib
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 db = get_database()
 
 @router.get("/tournaments")
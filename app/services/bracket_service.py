@@ -1,36 +1,142 @@
 from datetime import datetime, timedelta, timezone
-from app.models import Round, Match, Contestant
+from app.models import Round, Match, Contestant, BracketLayout
 from app.database import get_database
+from app.services.stats_service import record_round
 from bson.objectid import ObjectId
 import random
 
 
 db = get_database()
 
-def create_initial_round(contestants: list[Contestant], duration_minutes: int) -> list[Round]:
-    random.shuffle(contestants)
-    matches = []
-    match_id_counter = 1
-    
-    for i in range(0, len(contestants), 2):
-        player_a = contestants[i]
-        player_b = contestants[i+1] if i+1 < len(contestants) else None
-        
-        matches.append(Match(
-            match_id=match_id_counter,
-            contestant_a=player_a,
-            contestant_b=player_b
+def _seed_order(size: int) -> list[int]:
+    """
+    Standard bracket seeding for a power-of-two `size`: [1, 8, 4, 5, 2, 7, 3, 6] for 8.
+    Seeds above the number of contestants become byes, so byes land next to the
+    top seeds and spread evenly over both halves of the tree.
+    """
+    order = [1]
+    while len(order) < size:
+        mirror = len(order) * 2 + 1
+        order = [seed for s in order for seed in (s, mirror - s)]
+    return order
+
+def _slot_id(round_index: int, match_index: int) -> str:
+    return f"{round_index}-{match_index}"
+
+def _slot_path(slot_id: str) -> str:
+    round_index, match_index = slot_id.split("-")
+    return f"rounds.{round_index}.matches.{match_index}"
+
+def create_bracket(contestants: list[Contestant], duration_minutes: int) -> tuple[list[Round], BracketLayout]:
+    """
+    Precomputes the whole tree: every round and slot exists from the start, each
+    slot knows its parent slot, and byes are already advanced. Later rounds get a
+    projected end_time that is reset when the round actually opens.
+    """
+    random.shuffle(contestants)  # Shuffled order = seed order
+    size = 1
+    while size < len(contestants):
+        size *= 2
+    total_rounds = size.bit_length() - 1
+
+    now = datetime.now(timezone.utc)
+    rounds = []
+    for r in range(total_rounds):
+        matches = []
+        for i in range(size >> (r + 1)):
+            is_last = r == total_rounds - 1
+            matches.append(Match(
+                match_id=i + 1,
+                slot_id=_slot_id(r, i),
+                parent_slot=None if is_last else _slot_id(r + 1, i // 2),
+                parent_side=None if is_last else ("a" if i % 2 == 0 else "b")
+            ))
+        rounds.append(Round(
+            round_index=r,
+            round_name=f"Round {r + 1}",
+            matches=matches,
+            end_time=now + timedelta(minutes=duration_minutes * (r + 1))
         ))
-        match_id_counter += 1
 
-    first_round = Round(
-        round_index=0,
-        round_name="Round 1",
-        matches=matches,
-        end_time=datetime.now(timezone.utc) + timedelta(minutes=duration_minutes)
+    # Fill round 1 in seed order; a missing seed is a bye
+    seeds = _seed_order(size)
+    for i, match in enumerate(rounds[0].matches):
+        seed_a, seed_b = seeds[2 * i], seeds[2 * i + 1]
+        match.contestant_a = contestants[seed_a - 1]
+        if seed_b <= len(contestants):
+            match.contestant_b = contestants[seed_b - 1]
+        else:
+            match.is_bye = True
+            match.winner_id = match.contestant_a.id
+            parent = rounds[1].matches[i // 2]
+            setattr(parent, f"contestant_{match.parent_side}", match.contestant_a)
+
+    return rounds, build_layout(rounds)
+
+def build_layout(rounds: list[Round]) -> BracketLayout:
+    """Slot ids per column for #bracket-left / #bracket-right / #bracket-final."""
+    layout = BracketLayout()
+    for r in rounds[:-1]:
+        slots = [m.slot_id for m in r.matches]
+        mid = len(slots) // 2
+        layout.left.append(slots[:mid])
+        layout.right.append(slots[mid:])
+    layout.final = [m.slot_id for m in rounds[-1].matches]
+    return layout
+
+def _pick_winner(match: dict) -> dict:
+    if match["contestant_b"] is None:
+        return match["contestant_a"]
+    # Tie-breaker: If votes equal, A wins (random shuffle happened at start)
+    if match["votes_a"] >= match["votes_b"]:
+        return match["contestant_a"]
+    return match["contestant_b"]
+
+def _record_round_stats(t: dict, round_index: int, round_data: dict, is_final: bool):
+    """Stats must never block or undo a close; a failed round is left for the backfill."""
+    try:
+        record_round(t, round_index, round_data, is_final=is_final)
+    except Exception as e:
+        print(f"❌ STATS UPDATE FAILED for {t['_id']} round {round_index}: {e}")
+
+def _advance_bracket(t: dict, current_idx: int, current_round: dict):
+    """
+    Closes the current round of a precomputed tree: each winner is $set straight
+    into its parent slot, and the next round is opened, all in one update. The
+    update only applies if the round is still current, so concurrent requests
+    can't advance it twice.
+    """
+    now = datetime.now(timezone.utc)
+    is_final = current_idx == len(t["rounds"]) - 1
+    updates = {}
+
+    for i, match in enumerate(current_round["matches"]):
+        if match.get("winner_id"):
+            continue  # Byes were advanced when the bracket was built
+
+        winner = _pick_winner(match)
+        match["winner_id"] = winner["id"]
+        updates[f"rounds.{current_idx}.matches.{i}.winner_id"] = winner["id"]
+        if match.get("parent_slot"):
+            updates[f"{_slot_path(match['parent_slot'])}.contestant_{match['parent_side']}"] = winner
+
+    if is_final:
+        updates["status"] = "completed"
+        updates["is_active"] = False
+    else:
+        updates["current_round_index"] = current_idx + 1
+        updates[f"rounds.{current_idx + 1}.end_time"] = now + timedelta(minutes=t["voting_duration_minutes"])
+
+    result = db.tournaments.update_one(
+        {"_id": t["_id"], "status": "active", "current_round_index": current_idx},
+        {"$set": updates}
     )
-    
-    return [first_round]
+
+    # Fold the closed round into the cross-tournament statistics
+    if result.modified_count:
+        _record_round_stats(t, current_idx, current_round, is_final)
+
+    return db.tournaments.find_one({"_id": t["_id"]})
 
 def process_round_progression(tournament_id: str):
     t = db.tournaments.find_one({"_id": ObjectId(tournament_id)})
@@ -55,21 +161,16 @@ def process_round_progression(tournament_id: str):
     
     if now > end_time:
         # --- TIME IS UP, PROCESS WINNERS ---
+        if t.get("bracket_layout"):
+            return _advance_bracket(t, current_idx, current_round)
+
+        # Legacy tournaments (started before the precomputed tree): pair winners by position
         winners = []
         
         for match in current_round["matches"]:
-            if match["contestant_b"] is None:
-                winners.append(match["contestant_a"])
-                match["winner_id"] = match["contestant_a"]["id"]
-                continue
-
-            # Tie-breaker: If votes equal, A wins (random shuffle happened at start)
-            if match["votes_a"] >= match["votes_b"]:
-                winners.append(match["contestant_a"])
-                match["winner_id"] = match["contestant_a"]["id"]
-            else:
-                winners.append(match["contestant_b"])
-                match["winner_id"] = match["contestant_b"]["id"]
+            winner = _pick_winner(match)
+            winners.append(winner)
+            match["winner_id"] = winner["id"]
 
         # Save the results of the current round
         db.tournaments.update_one(
@@ -86,6 +187,7 @@ def process_round_progression(tournament_id: str):
                     "is_active": False      # Update Boolean
                 }}
             )
+            _record_round_stats(t, current_idx, current_round, is_final=True)
             return db.tournaments.find_one({"_id": ObjectId(tournament_id)})
 
         # CREATE NEXT ROUND
@@ -118,6 +220,9 @@ def process_round_progression(tournament_id: str):
                 "$push": {"rounds": new_round}
             }
         )
+
+        # Fold the closed round into the cross-tournament statistics
+        _record_round_stats(t, current_idx, current_round, is_final=False)
         return db.tournaments.find_one({"_id": ObjectId(tournament_id)})
 
     return t
\ No newline at end of file
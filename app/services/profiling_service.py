@@ -0,0 +1,349 @@
+import functools
+import inspect
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from fastapi.routing import APIRoute
+
+# CONFIG
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))
+SAMPLE_INTERVAL_SECONDS = 0.001
+
+# Frames from these packages count as "waiting" on the external service.
+# Spotipy talks to Spotify through requests/urllib3.
+_CATEGORY_MARKERS = [
+    ("mongo", tuple(f"{os.sep}{pkg}{os.sep}" for pkg in ("pymongo", "bson"))),
+    ("spotify", tuple(f"{os.sep}{pkg}{os.sep}" for pkg in ("spotipy", "requests", "urllib3"))),
+]
+
+_request_path: ContextVar[Optional[str]] = ContextVar("request_path", default=None)
+_wrapper_codes = set()
+_label_cache = {}
+
+
+def _categorize(filename: str) -> str:
+    for category, markers in _CATEGORY_MARKERS:
+        if any(marker in filename for marker in markers):
+            return category
+    return "python"
+
+
+def _label(code) -> str:
+    label = _label_cache.get(code)
+    if label is None:
+        short_file = "/".join(code.co_filename.replace("\\", "/").split("/")[-2:])
+        label = f"{code.co_name} ({short_file}:{code.co_firstlineno})"
+        _label_cache[code] = label
+    return label
+
+
+# --- COLLECTORS ---
+class _Tracer:
+    """
+    Deterministic collector, installed with sys.setprofile on the thread running
+    the endpoint. Records self-time per full call stack (folded format).
+    """
+
+    def __init__(self):
+        self.stack = []  # [path, category, start, child_time]
+        self.folded = Counter()
+        self.totals = Counter()
+
+    def __call__(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == "call" or event == "c_call":
+            if event == "call":
+                name = _label(frame.f_code)
+                category = _categorize(frame.f_code.co_filename)
+            else:
+                name = getattr(arg, "__qualname__", repr(arg))
+                category = "python"
+
+            if self.stack:
+                parent = self.stack[-1]
+                path = parent[0] + ";" + name
+                # Anything called from inside pymongo/spotipy is time spent on that service
+                if parent[1] != "python":
+                    category = parent[1]
+            else:
+                path = name
+            self.stack.append([path, category, now, 0.0])
+        elif self.stack:  # return, c_return, c_exception
+            path, category, start, child_time = self.stack.pop()
+            elapsed = now - start
+            self_time = elapsed - child_time
+            self.folded[path] += self_time
+            self.totals[category] += self_time
+            if self.stack:
+                self.stack[-1][3] += elapsed
+
+
+class _Sampler(threading.Thread):
+    """
+    Statistical collector: snapshots one thread's stack every SAMPLE_INTERVAL_SECONDS.
+    The sampler only wakes when it gets the GIL, which is right away while the
+    target waits on a socket but only every sys.getswitchinterval() while it runs
+    Python code. Each sample is therefore weighted by the time since the previous
+    one, not counted as 1.
+    """
+
+    def __init__(self, thread_id: int):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stop_event = threading.Event()
+        self.folded = Counter()
+        self.totals = Counter()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stop_event.wait(SAMPLE_INTERVAL_SECONDS):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            names = []
+            category = "python"
+            # Walk from the innermost frame out to our endpoint wrapper
+            while frame is not None and frame.f_code not in _wrapper_codes:
+                names.append(_label(frame.f_code))
+                frame_category = _categorize(frame.f_code.co_filename)
+                if frame_category != "python":
+                    category = frame_category  # outermost service frame wins
+                frame = frame.f_back
+
+            if names:
+                self.folded[";".join(reversed(names))] += elapsed
+                self.totals[category] += elapsed
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+# --- CAPTURES ---
+class Capture:
+    def __init__(self, capture_id: int, mode: str, path: str):
+        self.capture_id = capture_id
+        self.mode = mode
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.duration_ms = 0.0
+        self.breakdown_ms = {"python": 0.0, "mongo": 0.0, "spotify": 0.0}
+        self.folded = Counter()
+        self.completed = False
+
+    @contextmanager
+    def profiling(self):
+        if self.mode == "deterministic":
+            # sys.setprofile is per thread; ProfilingService.claim keeps this to
+            # one deterministic capture at a time, and we hand back whatever
+            # profiler (debugger, coverage) was installed before.
+            collector = _Tracer()
+            previous = sys.getprofile()
+            start = time.perf_counter()
+            sys.setprofile(collector)
+            try:
+                yield
+            finally:
+                sys.setprofile(previous)
+                self._finish(collector, time.perf_counter() - start)
+        else:
+            collector = _Sampler(threading.get_ident())
+            start = time.perf_counter()
+            collector.start()
+            try:
+                yield
+            finally:
+                collector.stop()
+                self._finish(collector, time.perf_counter() - start)
+
+    def _finish(self, collector, elapsed: float):
+        # Spread the wall time over the categories the collector observed
+        total = sum(collector.totals.values())
+        self.duration_ms = round(elapsed * 1000, 3)
+        for category in self.breakdown_ms:
+            share = collector.totals[category] / total if total else 0.0
+            self.breakdown_ms[category] = round(self.duration_ms * share, 3)
+        if not total:
+            self.breakdown_ms["python"] = self.duration_ms
+
+        # Both collectors record seconds; stacks are weighted in microseconds
+        for path, value in collector.folded.items():
+            weight = int(value * 1_000_000)
+            if weight > 0:
+                self.folded[path] += weight
+        self.completed = True
+
+    def summary(self) -> dict:
+        return {
+            "capture_id": self.capture_id,
+            "mode": self.mode,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "breakdown_ms": self.breakdown_ms,
+            "unit": "microseconds",
+        }
+
+    def to_folded(self) -> str:
+        """Brendan Gregg's collapsed-stack format (flamegraph.pl, speedscope)."""
+        return "\n".join(f"{path} {weight}" for path, weight in self.folded.most_common()) + "\n"
+
+
+class ProfilingService:
+    """
+    Holds the admin-armed profiling rule and the ring buffer of finished captures.
+    While nothing is armed, requests only pay for a single attribute check.
+    Only one deterministic capture runs at a time: matching requests that arrive
+    meanwhile are served unprofiled and leave the slot for a later request.
+    """
+
+    def __init__(self, buffer_size: int = PROFILE_BUFFER_SIZE):
+        self.armed = False
+        self.mode = "sampling"
+        self.remaining = 0
+        self.route = None
+        self.tournament_id = None
+        self.captures = deque(maxlen=buffer_size)
+        self._ids = itertools.count(1)
+        self._tracing = False
+        self._lock = threading.Lock()
+
+    def arm(self, mode: str, requests: int, route: Optional[str] = None, tournament_id: Optional[str] = None):
+        with self._lock:
+            self.mode = mode
+            self.remaining = requests
+            self.route = route
+            self.tournament_id = tournament_id
+            self.armed = requests > 0
+
+    def disarm(self):
+        with self._lock:
+            self.armed = False
+            self.remaining = 0
+
+    def status(self) -> dict:
+        return {
+            "armed": self.armed,
+            "mode": self.mode,
+            "remaining": self.remaining,
+            "route": self.route,
+            "tournament_id": self.tournament_id,
+            "captures": [c.summary() for c in self.captures],
+        }
+
+    def get_capture(self, capture_id: int) -> Optional[Capture]:
+        for capture in self.captures:
+            if capture.capture_id == capture_id:
+                return capture
+        return None
+
+    def _matches(self, path: str) -> bool:
+        if self.route and not path.startswith(self.route):
+            return False
+        if self.tournament_id and self.tournament_id not in path.split("/"):
+            return False
+        return True
+
+    def claim(self, path: Optional[str]) -> Optional[Capture]:
+        """Takes one of the armed slots if `path` matches the rule."""
+        with self._lock:
+            if not self.armed or path is None or not self._matches(path):
+                return None
+            if self.mode == "deterministic":
+                if self._tracing:
+                    return None
+                self._tracing = True
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.armed = False
+            return Capture(next(self._ids), self.mode, path)
+
+    def finish(self, capture: Capture):
+        with self._lock:
+            if capture.mode == "deterministic":
+                self._tracing = False
+            if capture.completed:
+                self.captures.append(capture)
+
+
+profiler = ProfilingService()
+
+
+# --- FASTAPI INTEGRATION ---
+class ProfilingMiddleware:
+    """
+    Plain ASGI middleware (BaseHTTPMiddleware would cost every request a task).
+    Only remembers the request path while armed; slots are claimed by the endpoint
+    wrapper, so unprofiled routes and requests rejected by auth or validation
+    never use one up.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.armed or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_path.set(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_path.reset(token)
+
+
+def _wrap_endpoint(endpoint):
+    """
+    Claims a slot and profiles the endpoint if the request matches the armed rule.
+    The wrapper executes on the same thread as the endpoint (threadpool for sync
+    routes), which is what the collectors need. For async routes, other tasks
+    awaited meanwhile show up too.
+    """
+    if getattr(endpoint, "__profiled__", False):
+        return endpoint
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def profiled_endpoint(*args, **kwargs):
+            capture = profiler.claim(_request_path.get()) if profiler.armed else None
+            if capture is None:
+                return await endpoint(*args, **kwargs)
+            try:
+                with capture.profiling():
+                    return await endpoint(*args, **kwargs)
+            finally:
+                profiler.finish(capture)
+    else:
+        @functools.wraps(endpoint)
+        def profiled_endpoint(*args, **kwargs):
+            capture = profiler.claim(_request_path.get()) if profiler.armed else None
+            if capture is None:
+                return endpoint(*args, **kwargs)
+            try:
+                with capture.profiling():
+                    return endpoint(*args, **kwargs)
+            finally:
+                profiler.finish(capture)
+
+    _wrapper_codes.add(profiled_endpoint.__code__)
+    profiled_endpoint.__profiled__ = True
+    return profiled_endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """Route class for routers whose endpoints can be profiled on demand."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _wrap_endpoint(endpoint), **kwargs)
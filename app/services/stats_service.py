@@ -0,0 +1,220 @@
+import base64
+import json
+from collections import defaultdict
+from typing import Optional
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from app.database import get_database
+
+db = get_database()
+
+# Every counter is $inc'ed on every write (even by 0), so all documents carry all
+# fields and the keyset pagination below never has to deal with missing values.
+STAT_FIELDS = ["wins", "losses", "titles", "total_votes", "margin", "tournaments_entered"]
+
+
+# --- INDEXES ---
+def ensure_stats_indexes():
+    for collection in (db.song_stats, db.artist_stats):
+        for field in STAT_FIELDS:
+            collection.create_index([(field, DESCENDING), ("_id", ASCENDING)])
+    db.match_stats.create_index([("margin", ASCENDING), ("_id", ASCENDING)])
+
+
+# --- AGGREGATION (pure, no DB access) ---
+def _empty_stats():
+    return dict.fromkeys(STAT_FIELDS, 0)
+
+
+def aggregate_round(round_index: int, round_data: dict, is_final: bool):
+    """
+    Turns one closed round into per-song / per-artist counter deltas and one
+    result document per contested match. Byes count as entries, not as wins.
+    """
+    songs = defaultdict(_empty_stats)
+    artists = defaultdict(_empty_stats)
+    song_info = {}
+    matches = []
+    entered_artists = set()
+
+    for match in round_data["matches"]:
+        a, b = match["contestant_a"], match.get("contestant_b")
+        for c in (a, b):
+            if c:
+                song_info[c["id"]] = c
+                songs[c["id"]]  # Touch, so byes still refresh title/artist
+                if round_index == 0:
+                    songs[c["id"]]["tournaments_entered"] += 1
+                    entered_artists.add(c["artist"])
+
+        if b is None or not match.get("winner_id"):
+            continue
+
+        votes = {a["id"]: match["votes_a"], b["id"]: match["votes_b"]}
+        margin = abs(match["votes_a"] - match["votes_b"])
+        for c in (a, b):
+            won = c["id"] == match["winner_id"]
+            for stats in (songs[c["id"]], artists[c["artist"]]):
+                stats["wins" if won else "losses"] += 1
+                stats["total_votes"] += votes[c["id"]]
+                stats["margin"] += margin if won else -margin
+
+        if match["votes_a"] + match["votes_b"] > 0:
+            matches.append({
+                "match_id": match["match_id"],
+                "contestant_a": {k: a.get(k) for k in ("id", "title", "artist")},
+                "contestant_b": {k: b.get(k) for k in ("id", "title", "artist")},
+                "votes_a": match["votes_a"],
+                "votes_b": match["votes_b"],
+                "winner_id": match["winner_id"],
+                "margin": margin,
+                "total_votes": match["votes_a"] + match["votes_b"],
+            })
+
+    for artist in entered_artists:
+        artists[artist]["tournaments_entered"] += 1
+
+    if is_final and len(round_data["matches"]) == 1:
+        champion_id = round_data["matches"][0].get("winner_id")
+        if champion_id in song_info:
+            songs[champion_id]["titles"] += 1
+            artists[song_info[champion_id]["artist"]]["titles"] += 1
+
+    return songs, artists, song_info, matches
+
+
+# --- WRITES ---
+def record_round(t: dict, round_index: int, round_data: dict, is_final: bool) -> bool:
+    """
+    Folds a closed round into the statistics collections. The round is first
+    claimed atomically in stats_recorded_rounds, so a live close and a backfill
+    running at the same time can't both count it. If a write fails, the claim is
+    released and the error re-raised so the backfill can retry the round; counters
+    from the failed attempt that did land are then counted again.
+    Returns False if the round was already recorded.
+    """
+    claimed = db.tournaments.update_one(
+        {"_id": t["_id"], "stats_recorded_rounds": {"$ne": round_index}},
+        {"$addToSet": {"stats_recorded_rounds": round_index}}
+    )
+    if claimed.modified_count == 0:
+        return False
+
+    songs, artists, song_info, matches = aggregate_round(round_index, round_data, is_final)
+
+    song_ops = [
+        UpdateOne(
+            {"_id": song_id},
+            {
+                "$inc": stats,
+                "$set": {
+                    "title": song_info[song_id]["title"],
+                    "artist": song_info[song_id]["artist"],
+                    "image_url": song_info[song_id].get("image_url"),
+                }
+            },
+            upsert=True
+        )
+        for song_id, stats in songs.items()
+    ]
+    artist_ops = [
+        UpdateOne({"_id": artist}, {"$inc": stats}, upsert=True)
+        for artist, stats in artists.items()
+    ]
+    match_ops = [
+        UpdateOne(
+            {"_id": f"{t['_id']}:{round_index}:{m['match_id']}"},
+            {"$set": {
+                **m,
+                "tournament_id": str(t["_id"]),
+                "tournament_name": t.get("name"),
+                "round_index": round_index,
+                "round_name": round_data.get("round_name"),
+            }},
+            upsert=True
+        )
+        for m in matches
+    ]
+
+    try:
+        if song_ops:
+            db.song_stats.bulk_write(song_ops, ordered=False)
+        if artist_ops:
+            db.artist_stats.bulk_write(artist_ops, ordered=False)
+        if match_ops:
+            db.match_stats.bulk_write(match_ops, ordered=False)
+    except Exception:
+        db.tournaments.update_one(
+            {"_id": t["_id"]},
+            {"$pull": {"stats_recorded_rounds": round_index}}
+        )
+        raise
+    return True
+
+
+def backfill_statistics() -> int:
+    """One-off job: records every closed round of existing tournaments."""
+    ensure_stats_indexes()
+    recorded = 0
+    tournaments = db.tournaments.find(
+        {"status": {"$in": ["active", "completed"]}},
+        {"name": 1, "status": 1, "rounds": 1, "current_round_index": 1}
+    )
+    for t in tournaments:
+        rounds = t.get("rounds", [])
+        for idx, round_data in enumerate(rounds):
+            if not all(m.get("winner_id") for m in round_data["matches"]):
+                continue  # Still being voted on
+
+            is_final = t.get("status") == "completed" and idx == len(rounds) - 1
+            if record_round(t, idx, round_data, is_final):
+                recorded += 1
+    return recorded
+
+
+# --- READS (keyset pagination: cost depends on the page size only) ---
+def encode_cursor(value, doc_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, doc_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        value, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+    # Both end up in a Mongo filter: anything but plain scalars could smuggle in operators
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(doc_id, str):
+        raise ValueError("Invalid cursor")
+    return value, doc_id
+
+
+def _paginate(collection, field: str, direction: int, cursor: Optional[str], limit: int) -> dict:
+    query = {}
+    if cursor:
+        value, doc_id = decode_cursor(cursor)
+        past = "$lt" if direction == DESCENDING else "$gt"
+        query = {"$or": [{field: {past: value}}, {field: value, "_id": {"$gt": doc_id}}]}
+
+    items = list(collection.find(query).sort([(field, direction), ("_id", ASCENDING)]).limit(limit))
+    next_cursor = None
+    if len(items) == limit:
+        next_cursor = encode_cursor(items[-1][field], items[-1]["_id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def get_song_leaderboard(sort: str, cursor: Optional[str], limit: int) -> dict:
+    return _paginate(db.song_stats, sort, DESCENDING, cursor, limit)
+
+
+def get_artist_leaderboard(sort: str, cursor: Optional[str], limit: int) -> dict:
+    return _paginate(db.artist_stats, sort, DESCENDING, cursor, limit)
+
+
+def get_closest_matches(cursor: Optional[str], limit: int) -> dict:
+    return _paginate(db.match_stats, "margin", ASCENDING, cursor, limit)
+
+
+if __name__ == "__main__":
+    print("📊 Backfilling tournament statistics...")
+    count = backfill_statistics()
+    print(f"✅ Recorded {count} rounds.")
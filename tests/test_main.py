@@ -2,6 +2,7 @@ import pytest
 from httpx import AsyncClient, ASGITransport
 from app.main import app
 import os
+from bson.objectid import ObjectId
 
 # --- SETUP MOCK ENV ---
 # Ensure these match your actual .env or docker-compose keys
@@ -112,4 +113,352 @@ async def test_vote_page_split_structure():
         assert 'id="bracket-final"' in html
         
         # Verify the header includes the JS logic
-        assert '<script src="/static/script.js"></script>' in html
\ No newline at end of file
+        assert '<script src="/static/script.js"></script>' in html
+
+@pytest.mark.asyncio
+async def test_profiling_admin_endpoints():
+    """Arm, inspect and disarm the on-demand profiler (admin only)"""
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        # Requires a token
+        res = await ac.post("/api/admin/profiling/arm", json={"tournament_id": "abc"})
+        assert res.status_code == 401
+
+        token = (await ac.post("/api/admin/login", json={"password": "testpass"})).json()["access_token"]
+        auth_headers = {"Authorization": f"Bearer {token}"}
+
+        # Needs something to match on
+        res = await ac.post("/api/admin/profiling/arm", json={"requests": 2}, headers=auth_headers)
+        assert res.status_code == 400
+
+        res = await ac.post(
+            "/api/admin/profiling/arm",
+            json={"mode": "deterministic", "requests": 2, "tournament_id": "abc"},
+            headers=auth_headers
+        )
+        assert res.status_code == 200
+
+        status = (await ac.get("/api/admin/profiling", headers=auth_headers)).json()
+        assert status["armed"] is True
+        assert status["remaining"] == 2
+        assert status["mode"] == "deterministic"
+
+        await ac.post("/api/admin/profiling/disarm", headers=auth_headers)
+        status = (await ac.get("/api/admin/profiling", headers=auth_headers)).json()
+        assert status["armed"] is False
+
+        res = await ac.get("/api/admin/profiling/captures/999", headers=auth_headers)
+        assert res.status_code == 404
+
+
+def test_stats_round_aggregation():
+    """Closed rounds turn into per-song / per-artist deltas; byes are entries, not wins"""
+    from app.services.stats_service import aggregate_round
+
+    def song(i, artist):
+        return {"id": f"s{i}", "title": f"Song {i}", "artist": artist}
+
+    round_data = {
+        "round_name": "Round 1",
+        "matches": [
+            {"match_id": 1, "contestant_a": song(1, "X"), "contestant_b": song(2, "Y"),
+             "votes_a": 5, "votes_b": 3, "winner_id": "s1"},
+            {"match_id": 2, "contestant_a": song(3, "X"), "contestant_b": None,
+             "votes_a": 0, "votes_b": 0, "winner_id": "s3"},
+        ]
+    }
+    songs, artists, _, matches = aggregate_round(0, round_data, is_final=False)
+
+    assert songs["s1"]["wins"] == 1 and songs["s1"]["margin"] == 2 and songs["s1"]["total_votes"] == 5
+    assert songs["s2"]["losses"] == 1 and songs["s2"]["margin"] == -2
+    assert songs["s3"]["wins"] == 0 and songs["s3"]["tournaments_entered"] == 1
+    # Artist X has two songs in the tournament but entered it once
+    assert artists["X"]["tournaments_entered"] == 1
+    assert artists["X"]["wins"] == 1
+    assert [m["match_id"] for m in matches] == [1]
+
+    final = {"matches": [round_data["matches"][0]]}
+    songs, artists, _, _ = aggregate_round(2, final, is_final=True)
+    assert songs["s1"]["titles"] == 1 and artists["X"]["titles"] == 1
+    assert songs["s1"]["tournaments_entered"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stats_endpoints_validate_params():
+    """Leaderboard cursors round-trip; bad sort fields, cursors and page sizes are rejected"""
+    import base64
+    import json
+    from app.services.stats_service import encode_cursor, decode_cursor
+    song_id = "https://open.spotify.com/track/x"
+    assert decode_cursor(encode_cursor(3, song_id)) == (3, song_id)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        assert (await ac.get("/api/stats/songs?sort=popularity")).status_code == 422
+        assert (await ac.get("/api/stats/artists?cursor=not-a-cursor")).status_code == 400
+        # Cursors are client input: operator objects must not reach the Mongo filter
+        injected = base64.urlsafe_b64encode(json.dumps([{"$ne": None}, "z"]).encode()).decode()
+        assert (await ac.get(f"/api/stats/songs?cursor={injected}")).status_code == 400
+        assert (await ac.get("/api/stats/closest-matches?limit=500")).status_code == 422
+
+
+def test_bracket_precomputed_tree():
+    """The whole tree exists at start: seeded byes, parent pointers and a split layout"""
+    from app.models import Contestant
+    from app.services.bracket_service import create_bracket
+
+    contestants = [
+        Contestant(id=f"s{i}", title=f"Song {i}", artist="A", original_url=f"s{i}")
+        for i in range(13)
+    ]
+    rounds, layout = create_bracket(contestants, 10)
+
+    # 13 songs -> 16-slot tree with 3 byes, never two byes in one match
+    assert [len(r.matches) for r in rounds] == [8, 4, 2, 1]
+    first = rounds[0].matches
+    assert sum(m.is_bye for m in first) == 3
+    assert all(m.contestant_a for m in first)
+    # Byes are spread over both halves
+    assert any(m.is_bye for m in first[:4]) and any(m.is_bye for m in first[4:])
+
+    # Bye winners are already in their parent slot
+    slots = {m.slot_id: m for r in rounds for m in r.matches}
+    for m in first:
+        if m.is_bye:
+            parent = slots[m.parent_slot]
+            assert getattr(parent, f"contestant_{m.parent_side}").id == m.winner_id
+
+    assert rounds[-1].matches[0].parent_slot is None
+    assert layout.final == ["3-0"]
+    assert layout.left == [["0-0", "0-1", "0-2", "0-3"], ["1-0", "1-1"], ["2-0"]]
+    assert layout.right == [["0-4", "0-5", "0-6", "0-7"], ["1-2", "1-3"], ["2-1"]]
+
+
+@pytest.mark.asyncio
+async def test_profiling_captures_matching_endpoint():
+    """Only a profiled API endpoint uses up a slot, and its capture downloads as folded stacks"""
+    from app.database import get_database
+    db = get_database()
+    t_id = str(db.tournaments.insert_one({
+        "name": "Profiling Test",
+        "status": "completed",
+        "rounds": [],
+        "voting_duration_minutes": 60,
+        "current_round_index": 0
+    }).inserted_id)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        token = (await ac.post("/api/admin/login", json={"password": "testpass"})).json()["access_token"]
+        auth_headers = {"Authorization": f"Bearer {token}"}
+        await ac.post(
+            "/api/admin/profiling/arm",
+            json={"mode": "deterministic", "requests": 1, "tournament_id": t_id},
+            headers=auth_headers
+        )
+
+        # Matching paths outside profiled endpoints and rejected requests don't use up the slot
+        assert (await ac.get(f"/api/vote/unknown/{t_id}")).status_code == 404
+        assert (await ac.post(f"/api/admin/{t_id}/start")).status_code == 401
+        status = (await ac.get("/api/admin/profiling", headers=auth_headers)).json()
+        assert status["armed"] is True and status["remaining"] == 1
+
+        res = await ac.get(f"/api/vote/tournament/{t_id}")
+        assert res.status_code == 200
+
+        status = (await ac.get("/api/admin/profiling", headers=auth_headers)).json()
+        assert status["armed"] is False
+        capture = status["captures"][-1]
+        assert capture["path"] == f"/api/vote/tournament/{t_id}"
+        assert capture["unit"] == "microseconds"
+
+        res = await ac.get(f"/api/admin/profiling/captures/{capture['capture_id']}", headers=auth_headers)
+        assert res.status_code == 200
+        assert "attachment" in res.headers["content-disposition"]
+        # "frame;frame;... <weight>" lines, rooted at the endpoint
+        first = res.text.splitlines()[0]
+        stack, weight = first.rsplit(" ", 1)
+        assert int(weight) > 0
+        assert "get_tournament_bracket" in res.text
+
+
+def test_stats_record_round_once():
+    """A recorded round is marked on the tournament and never counted twice"""
+    from app.database import get_database
+    from app.services.stats_service import record_round
+    db = get_database()
+
+    song_a = {"id": "stats-test-a", "title": "A", "artist": "Stats Artist A"}
+    song_b = {"id": "stats-test-b", "title": "B", "artist": "Stats Artist B"}
+    round_data = {"round_name": "Round 1", "matches": [
+        {"match_id": 1, "contestant_a": song_a, "contestant_b": song_b,
+         "votes_a": 4, "votes_b": 1, "winner_id": "stats-test-a"}
+    ]}
+    t_id = db.tournaments.insert_one({"name": "Stats Test", "status": "completed", "rounds": [round_data]}).inserted_id
+    t = db.tournaments.find_one({"_id": t_id})
+    before = db.song_stats.find_one({"_id": "stats-test-a"}) or {"wins": 0, "titles": 0}
+
+    assert record_round(t, 0, round_data, is_final=True) is True
+    assert record_round(t, 0, round_data, is_final=True) is False
+
+    after = db.song_stats.find_one({"_id": "stats-test-a"})
+    assert after["wins"] == before["wins"] + 1
+    assert after["titles"] == before["titles"] + 1
+    assert db.tournaments.find_one({"_id": t_id})["stats_recorded_rounds"] == [0]
+
+
+@pytest.mark.asyncio
+async def test_bracket_progression_advances_slots_once():
+    """Closing a round $sets winners into parent slots exactly once, then completes on the final"""
+    from datetime import datetime, timedelta, timezone
+    from app.database import get_database
+    from app.services.bracket_service import process_round_progression, _advance_bracket
+    db = get_database()
+
+    contestants = [
+        {"id": f"prog-{i}", "title": f"Song {i}", "artist": f"Artist {i}", "original_url": f"prog-{i}"}
+        for i in range(5)
+    ]
+    t_id = str(db.tournaments.insert_one({
+        "name": "Progression Test",
+        "status": "draft",
+        "voting_duration_minutes": 10,
+        "current_round_index": 0,
+        "contestants": contestants,
+        "rounds": []
+    }).inserted_id)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        token = (await ac.post("/api/admin/login", json={"password": "testpass"})).json()["access_token"]
+        res = await ac.post(f"/api/admin/{t_id}/start", headers={"Authorization": f"Bearer {token}"})
+        assert res.status_code == 200
+
+    t = db.tournaments.find_one({"_id": ObjectId(t_id)})
+    assert [len(r["matches"]) for r in t["rounds"]] == [4, 2, 1]
+
+    previous_stale = None
+    for idx in range(len(t["rounds"])):
+        # B wins every contested match; close the round by moving its end_time into the past
+        db.tournaments.update_one({"_id": ObjectId(t_id)}, {"$set": {
+            f"rounds.{idx}.end_time": datetime.now(timezone.utc) - timedelta(minutes=1),
+            **{f"rounds.{idx}.matches.{i}.votes_b": 1 for i in range(len(t["rounds"][idx]["matches"]))}
+        }})
+
+        stale = db.tournaments.find_one({"_id": ObjectId(t_id)})
+        process_round_progression(t_id)
+        process_round_progression(t_id)  # Second call must not advance again
+        closed = db.tournaments.find_one({"_id": ObjectId(t_id)})
+
+        # Concurrent requests that read the tournament before a round closed change nothing
+        _advance_bracket(stale, idx, stale["rounds"][idx])
+        if previous_stale:
+            _advance_bracket(previous_stale, idx - 1, previous_stale["rounds"][idx - 1])
+        previous_stale = stale
+        t = db.tournaments.find_one({"_id": ObjectId(t_id)})
+        assert t == closed
+
+        for match in t["rounds"][idx]["matches"]:
+            expected = match["contestant_a"] if match["is_bye"] else match["contestant_b"]
+            assert match["winner_id"] == expected["id"]
+            if match["parent_slot"]:
+                r, i = (int(x) for x in match["parent_slot"].split("-"))
+                parent = t["rounds"][r]["matches"][i]
+                assert parent[f"contestant_{match['parent_side']}"]["id"] == match["winner_id"]
+
+        if idx < len(t["rounds"]) - 1:
+            assert t["status"] == "active"
+            assert t["current_round_index"] == idx + 1
+            # The next round opens with a fresh end_time
+            end_time = t["rounds"][idx + 1]["end_time"]
+            if end_time.tzinfo is None:
+                end_time = end_time.replace(tzinfo=timezone.utc)
+            assert end_time > datetime.now(timezone.utc)
+
+    assert t["status"] == "completed"
+    assert t["current_round_index"] == len(t["rounds"]) - 1
+    assert t["rounds"][-1]["matches"][0]["winner_id"]
+
+
+def test_stats_failed_write_releases_claim(monkeypatch):
+    """A failing stats write releases the round's claim so the backfill can retry it"""
+    from app.database import get_database
+    from app.services import stats_service
+    db = get_database()
+
+    class FailingCollection:
+        def bulk_write(self, *args, **kwargs):
+            raise RuntimeError("write failed")
+
+    class FailingArtistsDB:
+        def __getattr__(self, name):
+            return FailingCollection() if name == "artist_stats" else getattr(db, name)
+
+    round_data = {"round_name": "Round 1", "matches": [
+        {"match_id": 1,
+         "contestant_a": {"id": "claim-test-a", "title": "A", "artist": "Claim Artist A"},
+         "contestant_b": {"id": "claim-test-b", "title": "B", "artist": "Claim Artist B"},
+         "votes_a": 2, "votes_b": 1, "winner_id": "claim-test-a"}
+    ]}
+    t_id = db.tournaments.insert_one({"name": "Claim Test", "status": "completed", "rounds": [round_data]}).inserted_id
+    t = db.tournaments.find_one({"_id": t_id})
+
+    monkeypatch.setattr(stats_service, "db", FailingArtistsDB())
+    with pytest.raises(RuntimeError):
+        stats_service.record_round(t, 0, round_data, is_final=True)
+    assert db.tournaments.find_one({"_id": t_id}).get("stats_recorded_rounds") == []
+
+    monkeypatch.setattr(stats_service, "db", db)
+    assert stats_service.record_round(t, 0, round_data, is_final=True) is True
+    assert db.tournaments.find_one({"_id": t_id})["stats_recorded_rounds"] == [0]
+
+
+def test_bracket_close_survives_stats_failure(monkeypatch):
+    """A failing stats update is logged; the round still advances and the bracket still loads"""
+    from datetime import datetime, timedelta, timezone
+    from app.database import get_database
+    from app.models import Contestant
+    from app.services import bracket_service
+    db = get_database()
+
+    contestants = [Contestant(id=f"fail-{i}", title="T", artist="A", original_url=f"fail-{i}") for i in range(4)]
+    rounds, layout = bracket_service.create_bracket(contestants, 10)
+    rounds[0].end_time = datetime.now(timezone.utc) - timedelta(minutes=1)
+    t_id = str(db.tournaments.insert_one({
+        "name": "Stats Failure Test",
+        "status": "active",
+        "voting_duration_minutes": 10,
+        "current_round_index": 0,
+        "rounds": [r.dict() for r in rounds],
+        "bracket_layout": layout.dict()
+    }).inserted_id)
+
+    def failing_record_round(*args, **kwargs):
+        raise RuntimeError("stats down")
+    monkeypatch.setattr(bracket_service, "record_round", failing_record_round)
+
+    t = bracket_service.process_round_progression(t_id)
+    assert t["current_round_index"] == 1
+    assert all(m["winner_id"] for m in t["rounds"][0]["matches"])
+
+
+def test_profiling_sampling_breakdown_matches_wall_time():
+    """Samples are weighted by elapsed time, so CPU work isn't under-counted against socket waits"""
+    import time
+    from app.services.profiling_service import Capture
+
+    # A "driver" function whose frames are attributed to Mongo
+    fake_driver = {}
+    exec(compile("import time\ndef wait():\n    time.sleep(0.2)\n", os.path.join(os.sep, "fake", "pymongo", "wait.py"), "exec"), fake_driver)
+
+    def busy(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    capture = Capture(1, "sampling", "/api/vote/tournaments")
+    with capture.profiling():
+        busy(0.2)
+        fake_driver["wait"]()
+
+    breakdown = capture.breakdown_ms
+    assert capture.summary()["unit"] == "microseconds"
+    assert 120 < breakdown["python"] < 280
+    assert 120 < breakdown["mongo"] < 280
+    assert "wait (pymongo/wait.py:2)" in capture.to_folded()